@@ -5,7 +5,7 @@ sudo apt-get update
 
 # Core tools
 sudo apt-get install -y \
-  python3 python3-pip python3-gi python3-aiohttp \
+  python3 python3-pip python3-gi python3-aiohttp python3-uvloop \
   gstreamer1.0-tools \
   gstreamer1.0-libcamera \
   gstreamer1.0-plugins-base \
@@ -4,12 +4,32 @@ import asyncio
 import json
 import os
 import signal
+import socket
 import sys
+import threading
 import traceback
+from collections import deque
 from typing import Optional
 
 from aiohttp import web
 
+try:
+    import uvloop  # optional: faster event loop for the signalling WebSocket
+except ImportError:
+    uvloop = None
+
+try:
+    import orjson  # optional: faster JSON for signalling payloads
+
+    def _dumps(obj: dict) -> str:
+        return orjson.dumps(obj).decode()
+
+    _loads = orjson.loads
+except ImportError:
+    orjson = None
+    _dumps = json.dumps
+    _loads = json.loads
+
 import gi
 gi.require_version("Gst", "1.0")
 gi.require_version("GstWebRTC", "1.0")
@@ -18,12 +38,60 @@ from gi.repository import GstSdp  # for SDP parsing
 
 Gst.init(None)
 
+# Bus message types we act on; everything else (state changes, QoS, ...) is dropped
+_BUS_MESSAGE_MASK = (
+    Gst.MessageType.ERROR | Gst.MessageType.WARNING | Gst.MessageType.EOS | Gst.MessageType.STREAM_STATUS
+)
+
+# Elements whose streaming tasks run SCHED_FIFO: qenc's src task feeds the encoder
+# (x264enc encodes in it, minus its sliced-threads workers) and v4l2h264enc pushes
+# encoded output from its own src-pad task
+_RT_TASK_OWNERS = ("qenc", "h264enc")
+
+# Writer-queue sentinel: close the viewer's WebSocket after the messages queued before it
+_CLOSE = {"type": "close"}
+
+
+def _on_stream_status(message: Gst.Message) -> None:
+    # ENTER/LEAVE are posted synchronously from the streaming thread itself, so the
+    # scheduler change applies to exactly that task's thread and is undone before the
+    # thread goes back to GStreamer's default task pool
+    status, owner = message.parse_stream_status()
+    if owner is None or owner.get_name() not in _RT_TASK_OWNERS:
+        return
+    try:
+        if status == Gst.StreamStatusType.ENTER:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(10))
+            print(f"[GStreamer] {owner.get_name()} streaming thread set to SCHED_FIFO priority 10")
+        elif status == Gst.StreamStatusType.LEAVE:
+            os.sched_setscheduler(0, os.SCHED_OTHER, os.sched_param(0))
+    except (AttributeError, OSError) as ex:
+        print(f"[GStreamer] Could not change {owner.get_name()} streaming thread priority: {ex}")
+
 
 def log_ex(ex: Exception, prefix: str = ""):
     print(f"{prefix}{ex}", file=sys.stderr)
     traceback.print_exc()
 
 
+# Plugin registry lookups resolved once at import; reused by every connection
+_FACTORIES = {
+    name: Gst.ElementFactory.find(name)
+    for name in (
+        "nicesrc", "nicesink", "libcamerasrc", "v4l2src", "videotestsrc",
+        "v4l2h264enc", "x264enc", "webrtcbin", "capsfilter", "queue",
+        "videoconvert", "videoscale", "h264parse", "tee", "rtph264pay",
+    )
+}
+
+
+def make_element(factory_name: str, name: Optional[str]) -> Optional[Gst.Element]:
+    if factory_name not in _FACTORIES:
+        return Gst.ElementFactory.make(factory_name, name)
+    factory = _FACTORIES[factory_name]
+    return factory.create(name) if factory is not None else None
+
+
 def link_chain(elements):
     for a, b in zip(elements, elements[1:]):
         ok = a.link(b)
@@ -33,73 +101,102 @@ def link_chain(elements):
             raise RuntimeError(f"Failed to link {a_name} -> {b_name}")
 
 
-class WebRTCCamera:
+def _set_leaky(queue, max_buffers: int = 2):
+    # Cap at a couple of frames and drop the oldest when downstream stalls
+    queue.set_property("max-size-buffers", max_buffers)
+    queue.set_property("max-size-bytes", 0)
+    queue.set_property("max-size-time", 0)
+    queue.set_property("leaky", 2)  # downstream
+
+
+def build_caps(width: int, height: int, fps: int) -> dict:
+    # Parsed once per server; Gst.Caps are refcounted and safe to share across pipelines
+    size = f"width={width},height={height},framerate={fps}/1"
+    return {
+        "src_raw": Gst.Caps.from_string(f"video/x-raw,{size}"),
+        "src_nv12": Gst.Caps.from_string(f"video/x-raw,format=NV12,{size}"),
+        "pre_nv12": Gst.Caps.from_string("video/x-raw,format=NV12"),
+        "pre_i420": Gst.Caps.from_string("video/x-raw,format=I420"),
+        "h264_hw": Gst.Caps.from_string(
+            "video/x-h264,profile=constrained-baseline,level=(string)4,stream-format=byte-stream,alignment=au"
+        ),
+        "h264_sw": Gst.Caps.from_string("video/x-h264,stream-format=byte-stream,alignment=au"),
+    }
+
+
+def _force_key_unit_event() -> Gst.Event:
+    # Upstream request for an IDR carrying SPS/PPS
+    return Gst.Event.new_custom(
+        Gst.EventType.CUSTOM_UPSTREAM,
+        Gst.Structure.new_from_string("GstForceKeyUnit,all-headers=(boolean)true"),
+    )
+
+
+class CameraPipeline:
+    # One capture + H.264 encode per server, fanned out to every viewer through a tee.
     def __init__(
         self,
-        ws,
-        loop: asyncio.AbstractEventLoop,
         width: int,
         height: int,
         fps: int,
         bitrate: int,
-        stun_server: Optional[str],
         source: str,
         v4l2_dev: Optional[str],
         force_sw: bool,
+        x264_preset: str = "superfast",
+        caps: Optional[dict] = None,
     ):
-        self.ws = ws
-        self.loop = loop
         self.width = width
         self.height = height
         self.fps = fps
         self.bitrate = bitrate
-        self.stun_server = stun_server
         self.source = source
         self.v4l2_dev = v4l2_dev
         self.force_sw = force_sw
+        self.x264_preset = x264_preset
+        self.caps = caps if caps is not None else build_caps(width, height, fps)
 
         self.pipeline: Optional[Gst.Pipeline] = None
-        self.webrtc: Optional[Gst.Element] = None
+        self.tee: Optional[Gst.Element] = None
+
+        # Viewer -> (tee src pad, branch elements); guarded since attach/detach run in executor threads
+        self._lock = threading.Lock()
+        self._branches: dict = {}
+
+        # Set by the bus handler when the running pipeline posted an ERROR. Not taken under
+        # _lock there: _stop_locked() joins streaming threads that may be posting it.
+        self._failed = False
 
     def build_pipeline(self) -> None:
-        pipeline = Gst.Pipeline.new("webrtc-pipeline")
+        pipeline = Gst.Pipeline.new("camera-pipeline")
 
         # Preflight: libnice
-        if Gst.ElementFactory.find("nicesrc") is None or Gst.ElementFactory.find("nicesink") is None:
+        if _FACTORIES["nicesrc"] is None or _FACTORIES["nicesink"] is None:
             raise RuntimeError("Missing libnice elements (nicesrc/nicesink). Install: sudo apt-get install -y gstreamer1.0-nice libnice10")
 
         # Source
         if self.source == "libcamera":
-            src = Gst.ElementFactory.make("libcamerasrc", "src")
+            src = make_element("libcamerasrc", "src")
             if not src:
                 raise RuntimeError("Missing plugin 'libcamerasrc'. Install gstreamer1.0-libcamera.")
         elif self.source == "v4l2":
-            src = Gst.ElementFactory.make("v4l2src", "src")
+            src = make_element("v4l2src", "src")
             if not src:
                 raise RuntimeError("Missing plugin 'v4l2src'. Install gstreamer1.0-plugins-good.")
             if self.v4l2_dev:
                 src.set_property("device", self.v4l2_dev)
         elif self.source == "test":
-            src = Gst.ElementFactory.make("videotestsrc", "src")
+            src = make_element("videotestsrc", "src")
             src.set_property("is-live", True)
             src.set_property("pattern", 0)
         else:
             raise RuntimeError(f"Unknown source: {self.source}")
 
-        # Caps WxH@FPS
-        caps_src = Gst.ElementFactory.make("capsfilter", "caps_src")
-        caps_src.set_property("caps", Gst.Caps.from_string(
-            f"video/x-raw,width={self.width},height={self.height},framerate={self.fps}/1"
-        ))
-
-        vconv = Gst.ElementFactory.make("videoconvert", "vconv")
-        vscale = Gst.ElementFactory.make("videoscale", "vscale")
-
         # Encoder
         enc = None
         using_hw = False
         if not self.force_sw:
-            enc = Gst.ElementFactory.make("v4l2h264enc", "h264enc")
+            enc = make_element("v4l2h264enc", "h264enc")
             if enc:
                 using_hw = True
                 try:
@@ -107,98 +204,381 @@ class WebRTCCamera:
                         enc.set_property("bitrate", int(self.bitrate))  # bps
                 except Exception:
                     pass
+                # Low-latency V4L2 M2M controls: constrained baseline, level 4.0, CBR,
+                # short GOP and SPS/PPS on every IDR so the encoder does not buffer.
+                controls = (
+                    "controls,h264_profile=1,h264_level=11,video_bitrate_mode=1,"
+                    f"h264_i_frame_period={int(max(1, self.fps * 2))},repeat_sequence_header=1"
+                )
+                if self.bitrate > 0:
+                    controls += f",video_bitrate={int(self.bitrate)}"
+                try:
+                    enc.set_property("extra-controls", Gst.Structure.new_from_string(controls))
+                except Exception:
+                    pass
 
         if enc is None:
-            enc = Gst.ElementFactory.make("x264enc", "h264enc")
+            enc = make_element("x264enc", "h264enc")
             if not enc:
                 raise RuntimeError("Missing H.264 encoder. Install gstreamer1.0-plugins-ugly (x264enc) or provide v4l2h264enc.")
             if self.bitrate > 0:
                 enc.set_property("bitrate", max(1, self.bitrate // 1000))  # kbps
             enc.set_property("tune", "zerolatency")
-            enc.set_property("speed-preset", "ultrafast")
+            enc.set_property("speed-preset", self.x264_preset)
             enc.set_property("key-int-max", int(max(1, self.fps * 2)))
+            enc.set_property("bframes", 0)
+            enc.set_property("threads", os.cpu_count() or 4)
+            enc.set_property("sliced-threads", True)
+
+        # libcamerasrc can hand NV12 straight to the HW encoder; skip the CPU convert/scale pass
+        native_nv12 = using_hw and self.source == "libcamera"
+
+        # Caps WxH@FPS
+        caps_src = make_element("capsfilter", "caps_src")
+        if native_nv12:
+            caps_src.set_property("caps", self.caps["src_nv12"])
+        else:
+            caps_src.set_property("caps", self.caps["src_raw"])
+
+        # Leaky source queue: drop stale frames instead of building latency
+        queue_src = make_element("queue", "qsrc")
+        _set_leaky(queue_src)
 
-        caps_pre_enc = Gst.ElementFactory.make("capsfilter", "caps_pre_enc")
+        raw_chain = [src, caps_src, queue_src]
+        if not native_nv12:
+            vconv = make_element("videoconvert", "vconv")
+            vscale = make_element("videoscale", "vscale")
+            raw_chain += [vconv, vscale]
+
+        caps_pre_enc = make_element("capsfilter", "caps_pre_enc")
         if using_hw:
-            caps_pre_enc.set_property("caps", Gst.Caps.from_string("video/x-raw,format=NV12"))
+            caps_pre_enc.set_property("caps", self.caps["pre_nv12"])
         else:
-            caps_pre_enc.set_property("caps", Gst.Caps.from_string("video/x-raw,format=I420"))
+            caps_pre_enc.set_property("caps", self.caps["pre_i420"])
 
-        queue_enc = Gst.ElementFactory.make("queue", "qenc")
+        queue_enc = make_element("queue", "qenc")
+        _set_leaky(queue_enc)
 
-        h264parse = Gst.ElementFactory.make("h264parse", "h264parse")
-        try:
-            h264parse.set_property("config-interval", 1)
-        except Exception:
-            pass
+        # Pin encoder output so h264parse passes whole access units through untouched
+        caps_post_enc = make_element("capsfilter", "caps_post_enc")
+        if using_hw:
+            caps_post_enc.set_property("caps", self.caps["h264_hw"])
+        else:
+            caps_post_enc.set_property("caps", self.caps["h264_sw"])
 
-        pay = Gst.ElementFactory.make("rtph264pay", "pay0")
-        pay.set_property("pt", 96)
+        h264parse = make_element("h264parse", "h264parse")
         try:
-            pay.set_property("config-interval", 1)
+            h264parse.set_property("config-interval", 1)
         except Exception:
             pass
 
-        webrtcbin = Gst.ElementFactory.make("webrtcbin", "webrtcbin")
-        if not webrtcbin:
-            raise RuntimeError("Missing plugin 'webrtcbin'. Install gstreamer1.0-plugins-bad.")
-        if self.stun_server:
-            webrtcbin.set_property("stun-server", self.stun_server)
-
-        webrtcbin.connect("on-negotiation-needed", self._on_negotiation_needed)
-        webrtcbin.connect("on-ice-candidate", self._on_ice_candidate)
+        # Encoded stream is shared; keep flowing while no viewer is attached
+        tee = make_element("tee", "tee")
+        tee.set_property("allow-not-linked", True)
 
-        for el in [src, caps_src, vconv, vscale, caps_pre_enc, queue_enc, enc, h264parse, pay, webrtcbin]:
+        chain = raw_chain + [caps_pre_enc, queue_enc, enc, caps_post_enc, h264parse, tee]
+        for el in chain:
             pipeline.add(el)
 
-        link_chain([src, caps_src, vconv, vscale, caps_pre_enc, queue_enc, enc, h264parse, pay])
-
-        # Link payloader to webrtcbin
-        pay_src_pad = pay.get_static_pad("src")
-        if not pay_src_pad:
-            raise RuntimeError("Failed to get payloader src pad")
+        link_chain(chain)
 
-        if hasattr(webrtcbin, "request_pad_simple"):
-            webrtc_sink_pad = webrtcbin.request_pad_simple("sink_%u")
-        else:
-            webrtc_sink_pad = webrtcbin.get_request_pad("sink_%u")
-
-        if not webrtc_sink_pad:
-            raise RuntimeError("Failed to get webrtcbin sink pad")
-
-        if pay_src_pad.link(webrtc_sink_pad) != Gst.PadLinkReturn.OK:
-            raise RuntimeError("Failed to link payloader to webrtcbin")
+        # libcamerasrc buffers are dmabuf-backed even under plain video/x-raw caps; let the
+        # V4L2 M2M encoder import them instead of copying. Only when the frame needs no
+        # encoder-side padding (e.g. 1080 rows is not 16-aligned); otherwise keep the copy.
+        dmabuf = native_nv12 and self.width % 32 == 0 and self.height % 16 == 0
+        if dmabuf:
+            Gst.util_set_object_arg(enc, "output-io-mode", "dmabuf-import")
 
         self.pipeline = pipeline
-        self.webrtc = webrtcbin
+        self.tee = tee
 
+        # No GLib main loop runs here, so handle bus messages synchronously on the
+        # posting thread instead of queueing them for a signal watch.
         bus = self.pipeline.get_bus()
-        bus.add_signal_watch()
-        bus.connect("message", self._on_bus_message)
+        bus.set_sync_handler(self._on_bus_message)
 
-        print(f"[GStreamer] Pipeline built. Source={self.source} | Encoder={'v4l2h264enc (HW)' if using_hw else 'x264enc (SW)'} | pre-enc caps={caps_pre_enc.get_property('caps').to_string()}")
+        print(f"[GStreamer] Pipeline built. Source={self.source} | Encoder={'v4l2h264enc (HW)' if using_hw else 'x264enc (SW)'} | DMABuf import={dmabuf} | pre-enc caps={caps_pre_enc.get_property('caps').to_string()}")
 
-    def start(self) -> None:
-        if not self.pipeline:
-            self.build_pipeline()
+    def _start_locked(self) -> None:
+        if self.pipeline and self._failed:
+            # Source/encoder ERROR whose teardown has not run yet: do not join that pipeline
+            self._stop_locked()
+        if self.pipeline:
+            return
+        self.build_pipeline()
         ret = self.pipeline.set_state(Gst.State.PLAYING)
         if ret == Gst.StateChangeReturn.FAILURE:
+            self._stop_locked()
             raise RuntimeError("Failed to set pipeline to PLAYING")
         print("[GStreamer] Pipeline PLAYING")
 
     def stop(self) -> None:
+        with self._lock:
+            self._stop_locked()
+
+    def _stop_locked(self) -> None:
         if self.pipeline:
+            bus = self.pipeline.get_bus()
             self.pipeline.set_state(Gst.State.NULL)
+            # After NULL so the LEAVE stream-status messages are still handled; dropping
+            # the handler releases its reference back to this object
+            bus.set_sync_handler(None)
             print("[GStreamer] Pipeline stopped")
             self.pipeline = None
+            self.tee = None
+            self._branches.clear()
+        self._failed = False
+
+    def _teardown(self, bus: Gst.Bus) -> None:
+        # Only stop the pipeline that failed; the next attach() rebuilds it
+        with self._lock:
+            if self.pipeline is not None and self.pipeline.get_bus() == bus:
+                self._stop_locked()
+
+    def attach(self, viewer: "WebRTCCamera", branch: list) -> None:
+        # Camera and encoder start on the first viewer and then stay warm for reconnects
+        with self._lock:
+            self._start_locked()
+            for el in branch:
+                self.pipeline.add(el)
+            tee_pad = None
+            try:
+                link_chain(branch)
+                for el in reversed(branch):
+                    el.sync_state_with_parent()
+
+                if hasattr(self.tee, "request_pad_simple"):
+                    tee_pad = self.tee.request_pad_simple("src_%u")
+                else:
+                    tee_pad = self.tee.get_request_pad("src_%u")
+                if not tee_pad or tee_pad.link(branch[0].get_static_pad("sink")) != Gst.PadLinkReturn.OK:
+                    raise RuntimeError("Failed to link tee to viewer branch")
+            except Exception:
+                if tee_pad:
+                    self.tee.release_request_pad(tee_pad)
+                for el in branch:
+                    el.set_state(Gst.State.NULL)
+                    self.pipeline.remove(el)
+                raise
+            self._branches[viewer] = (tee_pad, branch)
+
+            # New viewer needs an IDR with SPS/PPS rather than waiting for the next GOP
+            tee_pad.send_event(_force_key_unit_event())
+            print(f"[GStreamer] Viewer attached ({len(self._branches)} active)")
+
+    def detach(self, viewer: "WebRTCCamera") -> None:
+        with self._lock:
+            entry = self._branches.pop(viewer, None)
+            if entry is None or not self.pipeline:
+                return
+            tee_pad, branch = entry
+            queue_sink = branch[0].get_static_pad("sink")
+            unlinked = threading.Event()
+
+            def on_idle(pad: Gst.Pad, info: Gst.PadProbeInfo) -> Gst.PadProbeReturn:
+                pad.unlink(queue_sink)
+                unlinked.set()
+                return Gst.PadProbeReturn.REMOVE
+
+            # Unlink only while the tee is not pushing on this pad: IDLE fires at once
+            # if it is idle, otherwise on the streaming thread after the current buffer
+            tee_pad.add_probe(Gst.PadProbeType.IDLE, on_idle)
+            if not unlinked.wait(1.0):
+                print("[GStreamer] Tee pad never went idle, unlinking viewer branch anyway")
+                tee_pad.unlink(queue_sink)
+            self.tee.release_request_pad(tee_pad)
+            for el in branch:
+                el.set_state(Gst.State.NULL)
+                self.pipeline.remove(el)
+            print(f"[GStreamer] Viewer detached ({len(self._branches)} active)")
+
+    def _viewer_for(self, obj: Gst.Object) -> Optional["WebRTCCamera"]:
+        ancestors = []
+        while obj is not None:
+            ancestors.append(obj)
+            obj = obj.get_parent()
+        for viewer, (_, branch) in list(self._branches.items()):
+            if any(el == a for el in branch for a in ancestors):
+                return viewer
+        return None
+
+    def _on_bus_message(self, bus, message):
+        t = message.type
+        if not t & _BUS_MESSAGE_MASK:
+            return Gst.BusSyncReply.DROP
+        if t == Gst.MessageType.STREAM_STATUS:
+            _on_stream_status(message)
+        elif t == Gst.MessageType.ERROR:
+            err, dbg = message.parse_error()
+            print(f"[GStreamer] ERROR: {err} debug: {dbg}", file=sys.stderr)
+            error = {"type": "error", "message": f"GStreamer ERROR: {err}"}
+            # State changes cannot run on the posting (streaming) thread; hand off to a worker
+            viewer = self._viewer_for(message.src)
+            if viewer is not None:
+                # Failure inside one viewer's branch: drop just that viewer
+                viewer._send_ws(error)
+                viewer.close()
+                threading.Thread(target=self.detach, args=(viewer,), daemon=True).start()
+            else:
+                # Source/encoder failure: close every viewer and tear down, so the next
+                # viewer gets a fresh pipeline
+                pipeline = self.pipeline
+                if pipeline is not None and pipeline.get_bus() == bus:
+                    self._failed = True
+                for viewer in list(self._branches):
+                    viewer._send_ws(error)
+                    viewer.close()
+                threading.Thread(target=self._teardown, args=(bus,), daemon=True).start()
+        elif t == Gst.MessageType.WARNING:
+            err, dbg = message.parse_warning()
+            print(f"[GStreamer] WARNING: {err} debug: {dbg}")
+        elif t == Gst.MessageType.EOS:
+            print("[GStreamer] EOS")
+        return Gst.BusSyncReply.DROP
+
+
+class WebRTCCamera:
+    # One viewer: queue -> rtph264pay -> webrtcbin branch on the shared CameraPipeline.
+    def __init__(
+        self,
+        ws,
+        loop: asyncio.AbstractEventLoop,
+        camera: CameraPipeline,
+        stun_server: Optional[str],
+    ):
+        self.ws = ws
+        self.loop = loop
+        self.camera = camera
+        self.stun_server = stun_server
+
+        self.webrtc: Optional[Gst.Element] = None
+
+        # Outbound signalling messages, drained by a single writer task on the loop
+        self._out_q: asyncio.Queue = asyncio.Queue()
+        self._writer_task: Optional[asyncio.Task] = None
+
+        # Trickle ICE from webrtcbin's thread: raw tuples, one loop wakeup per burst
+        self._ice_pending: deque = deque()
+        self._ice_flush_scheduled = False
+
+        # Set when the branch queue overflowed: drop deltas until the next keyframe
+        self._resync = False
+        self._keyframe_requested = False
+        self._branch_queue: Optional[Gst.Element] = None
+        self._branch_probe_id = 0
+        self._branch_overrun_id = 0
+
+    def build_branch(self) -> list:
+        # Auto-named elements: several viewers share one pipeline.
+        # This queue carries encoded AUs, so it is bounded by time rather than a couple of
+        # buffers, and a leak resynchronises on the next keyframe instead of corrupting the picture.
+        queue = make_element("queue", None)
+        queue.set_property("max-size-buffers", 0)
+        queue.set_property("max-size-bytes", 0)
+        queue.set_property("max-size-time", Gst.SECOND)
+        queue.set_property("leaky", 2)  # downstream
+        self._branch_overrun_id = queue.connect("overrun", self._on_branch_overrun)
+        self._branch_probe_id = queue.get_static_pad("src").add_probe(
+            Gst.PadProbeType.BUFFER, self._on_branch_buffer
+        )
+        self._branch_queue = queue
+
+        pay = make_element("rtph264pay", None)
+        pay.set_property("pt", 96)
+        try:
+            pay.set_property("config-interval", 1)
+        except Exception:
+            pass
+
+        webrtcbin = make_element("webrtcbin", None)
+        if not webrtcbin:
+            raise RuntimeError("Missing plugin 'webrtcbin'. Install gstreamer1.0-plugins-bad.")
+        if self.stun_server:
+            webrtcbin.set_property("stun-server", self.stun_server)
+
+        webrtcbin.connect("on-negotiation-needed", self._on_negotiation_needed)
+        webrtcbin.connect("on-ice-candidate", self._on_ice_candidate)
+
+        self.webrtc = webrtcbin
+        return [queue, pay, webrtcbin]
+
+    def start(self) -> None:
+        self.loop.call_soon_threadsafe(self._start_writer)
+        self.camera.attach(self, self.build_branch())
+
+    def stop(self) -> None:
+        if self.webrtc:
+            self.camera.detach(self)
             self.webrtc = None
+        if self._branch_queue is not None:
+            # The probe and overrun handler hold bound methods of this viewer; drop them
+            # so the queue -> viewer -> queue cycle does not outlive the connection
+            self._branch_queue.get_static_pad("src").remove_probe(self._branch_probe_id)
+            self._branch_queue.disconnect(self._branch_overrun_id)
+            self._branch_queue = None
+        self.loop.call_soon_threadsafe(self._stop_writer)
+
+    def close(self) -> None:
+        # Thread-safe: queued behind pending messages so the client still receives them
+        self.loop.call_soon_threadsafe(self._out_q.put_nowait, _CLOSE)
+
+    def _on_branch_overrun(self, queue: Gst.Element) -> None:
+        # Emitted on the tee thread right before the queue leaks its oldest AU
+        self._resync = True
+
+    def _on_branch_buffer(self, pad: Gst.Pad, info: Gst.PadProbeInfo) -> Gst.PadProbeReturn:
+        if not self._resync:
+            return Gst.PadProbeReturn.OK
+        if not info.get_buffer().has_flags(Gst.BufferFlags.DELTA_UNIT):
+            self._resync = False
+            self._keyframe_requested = False
+            return Gst.PadProbeReturn.OK
+        if not self._keyframe_requested:
+            self._keyframe_requested = True
+            pad.get_parent_element().get_static_pad("sink").push_event(_force_key_unit_event())
+        return Gst.PadProbeReturn.DROP
+
+    def _start_writer(self) -> None:
+        if self._writer_task is None:
+            self._writer_task = self.loop.create_task(self._writer())
+
+    def _stop_writer(self) -> None:
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            self._writer_task = None
+
+    async def _writer(self) -> None:
+        broken = False
+        while True:
+            batch = [await self._out_q.get()]
+            # Drain whatever else is ready (ICE trickle bursts) before yielding to the loop
+            while len(batch) < 32:
+                try:
+                    batch.append(self._out_q.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            # Keep draining after the socket goes away so the queue does not grow
+            if broken or self.ws.closed:
+                continue
+            # Client expects one JSON object per frame
+            try:
+                for obj in batch:
+                    if obj is _CLOSE:
+                        await self.ws.close()
+                        broken = True
+                        break
+                    await self.ws.send_str(_dumps(obj))
+            except (ConnectionResetError, RuntimeError) as ex:
+                print(f"[WS] Send failed, dropping further signalling: {ex}")
+                broken = True
 
     def _send_ws(self, obj: dict) -> None:
-        async def _send():
-            if not self.ws.closed:
-                await self.ws.send_json(obj)
-        # Force: send event loop running
-        asyncio.run_coroutine_threadsafe(_send(), self.loop)
+        # Safe from GStreamer threads: hand off to the writer task on the event loop
+        self.loop.call_soon_threadsafe(self._out_q.put_nowait, obj)
+
+    def send(self, obj: dict) -> None:
+        # Event-loop callers enqueue directly so replies stay ordered with GStreamer messages
+        self._out_q.put_nowait(obj)
 
     def _create_and_send_offer(self, element: Gst.Element) -> None:
         def on_offer_created(promise: Gst.Promise, _, __):
@@ -223,7 +603,17 @@ class WebRTCCamera:
         self._create_and_send_offer(element)
 
     def _on_ice_candidate(self, element: Gst.Element, mlineindex: int, candidate: str) -> None:
-        self._send_ws({"type": "ice", "ice": {"candidate": candidate, "sdpMLineIndex": mlineindex}})
+        self._ice_pending.append((mlineindex, candidate))
+        if not self._ice_flush_scheduled:
+            self._ice_flush_scheduled = True
+            self.loop.call_soon_threadsafe(self._flush_ice)
+
+    def _flush_ice(self) -> None:
+        # Clear the flag before draining so a concurrent append either lands here or reschedules
+        self._ice_flush_scheduled = False
+        while self._ice_pending:
+            mlineindex, candidate = self._ice_pending.popleft()
+            self._out_q.put_nowait({"type": "ice", "ice": {"candidate": candidate, "sdpMLineIndex": mlineindex}})
 
     def renegotiate(self) -> None:
         if self.webrtc:
@@ -243,19 +633,6 @@ class WebRTCCamera:
         if self.webrtc:
             self.webrtc.emit("add-ice-candidate", mlineindex, candidate)
 
-    def _on_bus_message(self, bus, message):
-        t = message.type
-        if t == Gst.MessageType.ERROR:
-            err, dbg = message.parse_error()
-            print(f"[GStreamer] ERROR: {err} debug: {dbg}", file=sys.stderr)
-            self._send_ws({"type": "error", "message": f"GStreamer ERROR: {err}"})
-        elif t == Gst.MessageType.WARNING:
-            err, dbg = message.parse_warning()
-            print(f"[GStreamer] WARNING: {err} debug: {dbg}")
-        elif t == Gst.MessageType.EOS:
-            print("[GStreamer] EOS")
-        return True
-
 
 class AppServer:
     def __init__(
@@ -270,6 +647,7 @@ class AppServer:
         source: str,
         v4l2_dev: Optional[str],
         force_sw: bool,
+        x264_preset: str = "superfast",
     ):
         self.host = host
         self.port = port
@@ -281,6 +659,11 @@ class AppServer:
         self.source = source
         self.v4l2_dev = v4l2_dev
         self.force_sw = force_sw
+        self.x264_preset = x264_preset
+        self.caps = build_caps(width, height, fps)
+        self.camera = CameraPipeline(
+            width, height, fps, bitrate, source, v4l2_dev, force_sw, x264_preset, self.caps
+        )
 
         self.app = web.Application()
         self.app.add_routes([
@@ -288,37 +671,54 @@ class AppServer:
             web.get("/ws", self.handle_ws),
             web.static("/static", "web"),
         ])
+        self.app.on_response_prepare.append(self._on_response_prepare)
+        self.app.on_cleanup.append(self._on_cleanup)
 
     async def handle_index(self, request: web.Request):
-        return web.FileResponse(path="web/index.html")
+        # FileResponse uses sendfile and answers If-None-Match/If-Modified-Since with 304
+        return web.FileResponse(path="web/index.html", headers={"Cache-Control": "public, max-age=300"})
+
+    async def _on_response_prepare(self, request: web.Request, response: web.StreamResponse):
+        if request.path.startswith("/static/") and response.status in (200, 304):
+            response.headers["Cache-Control"] = "public, max-age=86400"
+
+    async def _on_cleanup(self, app: web.Application):
+        await asyncio.get_running_loop().run_in_executor(None, self.camera.stop)
 
     async def handle_ws(self, request: web.Request):
-        ws = web.WebSocketResponse(heartbeat=15)
+        # Signalling frames are small JSON: no permessage-deflate, bounded frame size
+        ws = web.WebSocketResponse(heartbeat=15, autoping=True, compress=False, max_msg_size=64 * 1024)
         await ws.prepare(request)
 
+        # Larger kernel buffers absorb SDP/ICE bursts without extra wakeups
+        sock = request.transport.get_extra_info("socket") if request.transport else None
+        if sock is not None:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 256 * 1024)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 256 * 1024)
+            except OSError:
+                pass
+
         print("[WS] Client connected")
-        await ws.send_json({"type": "hello", "message": "ws-ready"})
+        await ws.send_json({"type": "hello", "message": "ws-ready"}, dumps=_dumps)
 
         # Get loop running
         loop = asyncio.get_running_loop()
 
-        camera = WebRTCCamera(
-            ws, loop,
-            self.width, self.height, self.fps, self.bitrate,
-            self.stun, self.source, self.v4l2_dev, self.force_sw
-        )
+        camera = WebRTCCamera(ws, loop, self.camera, self.stun)
 
+        # First viewer builds the shared pipeline (device open can block); keep the loop free
         try:
-            camera.start()
+            await loop.run_in_executor(None, camera.start)
         except Exception as e:
             log_ex(e, "[Server] Camera start failed: ")
-            await ws.send_json({"type": "error", "message": f"Camera start failed: {e}"})
+            camera.send({"type": "error", "message": f"Camera start failed: {e}"})
 
         try:
             async for msg in ws:
                 if msg.type == web.WSMsgType.TEXT:
                     try:
-                        data = json.loads(msg.data)
+                        data = _loads(msg.data)
                     except Exception:
                         continue
                     mtype = data.get("type")
@@ -328,7 +728,7 @@ class AppServer:
                             camera.handle_sdp_answer(sdp)
                         except Exception as ex:
                             log_ex(ex, "[Server] SDP answer error: ")
-                            await ws.send_json({"type": "error", "message": f"SDP answer error: {ex}"})
+                            camera.send({"type": "error", "message": f"SDP answer error: {ex}"})
                     elif mtype == "ice":
                         ice = data.get("ice", {})
                         candidate = ice.get("candidate")
@@ -336,17 +736,20 @@ class AppServer:
                         if candidate:
                             camera.handle_ice_candidate(candidate, int(sdpMLineIndex))
                     elif mtype == "ping":
-                        await ws.send_json({"type": "pong"})
+                        camera.send({"type": "pong"})
                     elif mtype == "ready":
                         camera.renegotiate()
                 elif msg.type == web.WSMsgType.ERROR:
                     print(f"[WS] Connection closed with exception: {ws.exception()}")
         finally:
-            camera.stop()
+            await loop.run_in_executor(None, camera.stop)
             print("[WS] Client disconnected")
         return ws
 
     def run(self):
+        if uvloop is not None:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            print("[Server] Using uvloop event loop")
         web.run_app(self.app, host=self.host, port=self.port)
 
 
@@ -363,6 +766,9 @@ def parse_args():
                         help="Video source: libcamera (default), v4l2 (/dev/videoX), test (videotestsrc)")
     parser.add_argument("--v4l2-dev", default=os.environ.get("V4L2_DEVICE", ""), help="V4L2 device path when --source v4l2, e.g. /dev/video0")
     parser.add_argument("--force-sw", action="store_true", help="Force software encoder (x264enc)")
+    parser.add_argument("--x264-preset", default="superfast",
+                        choices=["ultrafast", "superfast", "veryfast", "faster", "fast", "medium"],
+                        help="x264enc speed-preset for the software encoder (default superfast)")
     return parser.parse_args()
 
 
@@ -372,6 +778,6 @@ if __name__ == "__main__":
     v4l2_dev = args.v4l2_dev if args.v4l2_dev else None
     server = AppServer(
         args.host, args.port, args.width, args.height, args.fps, args.bitrate, stun,
-        args.source, v4l2_dev, args.force_sw
+        args.source, v4l2_dev, args.force_sw, args.x264_preset
     )
     server.run()
\ No newline at end of file